@@ -3,8 +3,8 @@ import os
 from dotenv import load_dotenv
 from web_scraper import WebScraper
 from knowledge_tree import KnowledgeTreeManager
-import json
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Load environment variables
 load_dotenv()
@@ -23,6 +23,102 @@ if 'current_subtopic' not in st.session_state:
     st.session_state.current_subtopic = None
 if 'expanded_subtopic' not in st.session_state:
     st.session_state.expanded_subtopic = None
+if 'expanded_cache' not in st.session_state:
+    st.session_state.expanded_cache = {}
+if 'batch_misses' not in st.session_state:
+    st.session_state.batch_misses = set()
+
+# Maximum number of subtopics expanded in one LLM call, to stay well within
+# the model's output token limit
+EXPAND_BATCH_SIZE = 3
+
+@st.cache_resource
+def get_scraper(serpapi_key, gemini_api_key):
+    """Return a WebScraper shared across reruns and sessions."""
+    return WebScraper(serpapi_key, gemini_api_key)
+
+@st.cache_resource
+def get_tree_manager(gemini_api_key):
+    """Return a KnowledgeTreeManager shared across reruns and sessions."""
+    return KnowledgeTreeManager(gemini_api_key)
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def gather_sources(topic, num_results, fast_mode, _serpapi_key, _gemini_api_key):
+    """
+    Search the web for a topic and extract the content of the results as a
+    list of {"title", "content", "url"} dicts. In fast mode the search snippets
+    are used instead of fetching each page. Results are cached per
+    (topic, num_results, fast_mode); this must not call any st.* element,
+    since those are replayed on a cache hit.
+    Raises LookupError if nothing could be found, so failures are not cached.
+    """
+    web_scraper = get_scraper(_serpapi_key, _gemini_api_key)
+    
+    # Search the web
+    search_results = web_scraper.search_web(topic, num_results=num_results)
+    
+    if not search_results:
+        raise LookupError("No search results found. Please try a different topic.")
+    
+    if fast_mode:
+        # Use the search snippets instead of fetching each page
+        contents = {i: result["snippet"] for i, result in enumerate(search_results)}
+    else:
+        # Extract content from search results
+        contents = {}
+        with ThreadPoolExecutor(max_workers=min(num_results, 8)) as executor:
+            futures = {
+                executor.submit(web_scraper.fetch_article_content, result["link"]): i
+                for i, result in enumerate(search_results)
+            }
+            for future in as_completed(futures):
+                contents[futures[future]] = future.result()
+    
+    # Keep the original search ranking order
+    content_data = []
+    for i, result in enumerate(search_results):
+        content = contents.get(i)
+        if content:
+            content_data.append({
+                "title": result["title"],
+                "content": content,
+                "url": result["link"]
+            })
+    
+    if not content_data:
+        raise LookupError("Could not extract content from any search result. Please try again.")
+    
+    return content_data
+
+def build_tree(topic, num_results, fast_mode, serpapi_key, gemini_api_key, on_progress=None, on_chunk=None):
+    """
+    Generate a knowledge tree for a topic from the web sources gathered for it.
+    The tree itself is cached by the KnowledgeTreeManager, and generation runs
+    outside st.cache_data so on_chunk can stream the partial LLM response to the page.
+    Raises LookupError if no sources could be gathered.
+    """
+    def report(percent, message):
+        if on_progress:
+            on_progress(percent, message)
+    
+    # Search the web and extract content
+    report(20, "Searching the web and extracting content...")
+    content_data = gather_sources(topic, num_results, fast_mode, serpapi_key, gemini_api_key)
+    knowledge_tree_manager = get_tree_manager(gemini_api_key)
+    
+    # Combine all content
+    combined_content = "\n\n".join([
+        f"SOURCE: {item['title']}\n{item['content']}" for item in content_data
+    ])
+    
+    # Generate knowledge tree
+    report(60, "Generating knowledge tree...")
+    knowledge_tree = knowledge_tree_manager.generate_knowledge_tree(topic, combined_content, on_chunk)
+    
+    # Add sources to the knowledge tree
+    knowledge_tree["sources"] = [item["url"] for item in content_data]
+    
+    return knowledge_tree
 
 # Get API keys from environment variables
 serpapi_key = os.getenv("SERP_API_KEY")
@@ -47,6 +143,7 @@ comprehensive knowledge tree structure. Enter a topic of interest, and the appli
 # Main search interface
 st.header("Research a Topic")
 topic = st.text_input("Enter a topic to research:", placeholder="e.g., Quantum Computing")
+fast_mode = st.checkbox("Fast mode (snippets only)", help="Build the tree from search snippets without fetching each page.")
 num_results = st.slider("Number of search results to analyze:", min_value=1, max_value=10, value=3)
 
 # Search button
@@ -58,71 +155,55 @@ if st.button("Generate Knowledge Tree"):
             # Show progress
             progress_bar = st.progress(0)
             status_text = st.empty()
+            preview = st.empty()
+            
+            def report_progress(percent, message):
+                status_text.text(message)
+                progress_bar.progress(percent)
+            
+            def show_partial(text):
+                preview.code(text, language="json")
+            
+            knowledge_tree = build_tree(topic, num_results, fast_mode, serpapi_key, gemini_api_key,
+                                        report_progress, show_partial)
+            preview.empty()
             
-            # Initialize components
-            status_text.text("Initializing web scraper...")
-            web_scraper = WebScraper(serpapi_key, gemini_api_key)
-            knowledge_tree_manager = KnowledgeTreeManager(gemini_api_key)
+            # Save to session state
+            st.session_state.knowledge_tree = knowledge_tree
+            st.session_state.current_subtopic = None
+            st.session_state.expanded_subtopic = None
+            st.session_state.expanded_cache = {}
+            st.session_state.batch_misses = set()
             
-            # Search the web
-            status_text.text("Searching the web for information...")
-            progress_bar.progress(20)
-            search_results = web_scraper.search_web(topic, num_results=num_results)
+            # Complete
+            status_text.text("Knowledge tree generated successfully!")
+            progress_bar.progress(100)
+            time.sleep(1)
+            status_text.empty()
+            progress_bar.empty()
             
-            if not search_results:
-                st.error("No search results found. Please try a different topic.")
-                status_text.empty()
-                progress_bar.empty()
-            else:
-                # Extract content from search results
-                status_text.text("Extracting content from websites...")
-                progress_bar.progress(40)
-                content_data = []
-                for i, result in enumerate(search_results):
-                    content = web_scraper.fetch_article_content(result["link"])
-                    if content:
-                        content_data.append({
-                            "title": result["title"],
-                            "content": content,
-                            "url": result["link"]
-                        })
-                    progress_bar.progress(40 + (i+1) * 20 // len(search_results))
-                
-                # Combine all content
-                combined_content = "\n\n".join([
-                    f"SOURCE: {item['title']}\n{item['content']}" for item in content_data
-                ])
-                
-                # Generate knowledge tree
-                status_text.text("Generating knowledge tree...")
-                progress_bar.progress(80)
-                knowledge_tree = knowledge_tree_manager.generate_knowledge_tree(topic, combined_content)
-                
-                # Add sources to the knowledge tree
-                knowledge_tree["sources"] = [item["url"] for item in content_data]
-                
-                # Save to session state
-                st.session_state.knowledge_tree = knowledge_tree
-                st.session_state.current_subtopic = None
-                st.session_state.expanded_subtopic = None
-                
-                # Complete
-                status_text.text("Knowledge tree generated successfully!")
-                progress_bar.progress(100)
-                time.sleep(1)
-                status_text.empty()
-                progress_bar.empty()
-                
-                # Force rerun to display the knowledge tree
-                st.rerun()
-                
+        except LookupError as e:
+            st.error(str(e))
+            status_text.empty()
+            progress_bar.empty()
+            preview.empty()
         except Exception as e:
             st.error(f"An error occurred: {str(e)}")
 
-# Display the knowledge tree if available
-if st.session_state.knowledge_tree:
-    st.header(f"Knowledge Tree: {st.session_state.knowledge_tree['topic']}")
-    
+def _subtopic_context(subtopic):
+    """Summarize a subtopic's key points as compact context for the LLM."""
+    return subtopic["name"] + "\n" + "\n".join(
+        f"{p['point']}: {p['explanation']}" for p in subtopic.get("key_points", [])
+    )
+
+def _select_subtopic(subtopic):
+    """Button callback: show a subtopic and clear any previous expansion."""
+    st.session_state.current_subtopic = subtopic
+    st.session_state.expanded_subtopic = None
+
+@st.fragment
+def _render_tree():
+    """Render the subtopic list and details; clicks in here only rerun this fragment."""
     # Create two columns for the layout
     col1, col2 = st.columns([1, 2])
     
@@ -132,10 +213,8 @@ if st.session_state.knowledge_tree:
         
         # Display each subtopic as a button
         for i, subtopic in enumerate(st.session_state.knowledge_tree.get("subtopics", [])):
-            if st.button(f"📚 {subtopic['name']}", key=f"subtopic_{i}"):
-                st.session_state.current_subtopic = subtopic
-                st.session_state.expanded_subtopic = None
-                st.rerun()
+            st.button(f"📚 {subtopic['name']}", key=f"subtopic_{i}",
+                      on_click=_select_subtopic, args=(subtopic,))
     
     # Display the selected subtopic in the second column
     with col2:
@@ -153,26 +232,53 @@ if st.session_state.knowledge_tree:
                 try:
                     status_text = st.empty()
                     status_text.text("Expanding subtopic with more details...")
+                    preview = st.empty()
                     
-                    # Initialize components if not already
-                    knowledge_tree_manager = KnowledgeTreeManager(gemini_api_key)
+                    knowledge_tree_manager = get_tree_manager(gemini_api_key)
+                    topic_name = st.session_state.knowledge_tree['topic']
+                    subtopic_name = st.session_state.current_subtopic['name']
+                    expanded_cache = st.session_state.expanded_cache
+                    batch_misses = st.session_state.batch_misses
                     
-                    # Get combined content from the knowledge tree
-                    combined_content = json.dumps(st.session_state.knowledge_tree)
+                    # Expand the selected subtopic together with a few others not yet
+                    # expanded, so later clicks are served from the cache. Subtopics a
+                    # batch couldn't produce are not batched again.
+                    if subtopic_name not in expanded_cache and subtopic_name not in batch_misses:
+                        pending = [st.session_state.current_subtopic] + [
+                            subtopic for subtopic in st.session_state.knowledge_tree.get("subtopics", [])
+                            if subtopic["name"] != subtopic_name
+                            and subtopic["name"] not in expanded_cache
+                            and subtopic["name"] not in batch_misses
+                        ]
+                        pending = pending[:EXPAND_BATCH_SIZE]
+                        if len(pending) > 1:
+                            expansions = knowledge_tree_manager.expand_subtopics_batch(
+                                topic_name,
+                                [subtopic["name"] for subtopic in pending],
+                                "\n\n".join(_subtopic_context(subtopic) for subtopic in pending),
+                                lambda text: preview.code(text, language="json")
+                            )
+                            expanded_cache.update(expansions)
+                            batch_misses.update(
+                                subtopic["name"] for subtopic in pending if subtopic["name"] not in expansions
+                            )
                     
-                    # Expand the subtopic
-                    expanded_subtopic = knowledge_tree_manager.expand_subtopic(
-                        st.session_state.knowledge_tree['topic'],
-                        st.session_state.current_subtopic['name'],
-                        combined_content
-                    )
+                    expanded_subtopic = expanded_cache.get(subtopic_name)
+                    if expanded_subtopic is None:
+                        # Fall back to expanding just the selected subtopic
+                        expanded_subtopic = knowledge_tree_manager.expand_subtopic(
+                            topic_name,
+                            subtopic_name,
+                            _subtopic_context(st.session_state.current_subtopic),
+                            lambda text: preview.code(text, language="json")
+                        )
                     
                     # Save to session state
                     st.session_state.expanded_subtopic = expanded_subtopic
                     
                     # Complete
                     status_text.empty()
-                    st.rerun()
+                    preview.empty()
                     
                 except Exception as e:
                     st.error(f"An error occurred while expanding the subtopic: {str(e)}")
@@ -189,6 +295,12 @@ if st.session_state.knowledge_tree:
                         st.markdown("**Examples:**")
                         for example in aspect['examples']:
                             st.markdown(f"- {example}")
+
+# Display the knowledge tree if available
+if st.session_state.knowledge_tree:
+    st.header(f"Knowledge Tree: {st.session_state.knowledge_tree['topic']}")
+    
+    _render_tree()
     
     # Display sources
     st.header("Sources")
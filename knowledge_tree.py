@@ -1,12 +1,25 @@
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.prompts import PromptTemplate
+import orjson
 import json
-from typing import Dict, List, Any
+import hashlib
+import copy
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Any, Optional
 import logging
+import re
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# JSON inside a markdown code block, or the outermost curly-brace span
+_JSON_FENCE_RE = re.compile(r'```(?:json)?\s*([\s\S]*?)\s*```')
+_JSON_BRACE_RE = re.compile(r'({[\s\S]*})')
+
+# Maximum number of parsed LLM responses kept per manager
+_MAX_CACHED_RESPONSES = 128
+
 class KnowledgeTreeManager:
     def __init__(self, gemini_api_key: str):
         self.gemini_api_key = gemini_api_key
@@ -15,14 +28,58 @@ class KnowledgeTreeManager:
             google_api_key=self.gemini_api_key,
             temperature=0.2
         )
+        # Exact-match LRU cache of parsed LLM responses, keyed by prompt inputs.
+        # The manager is shared across sessions, so access is guarded by a lock.
+        self._response_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+    
+    def _cache_key(self, *parts: str) -> str:
+        """Build a cache key from the inputs that determine an LLM response."""
+        return hashlib.md5("\x00".join(parts).encode()).hexdigest()
+    
+    def _cache_get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a copy of a cached response, or None if it isn't cached."""
+        with self._cache_lock:
+            if key not in self._response_cache:
+                return None
+            self._response_cache.move_to_end(key)
+            return copy.deepcopy(self._response_cache[key])
+    
+    def _cache_put(self, key: str, value: Dict[str, Any]) -> None:
+        """Cache a copy of a response, evicting the least recently used ones."""
+        with self._cache_lock:
+            self._response_cache[key] = copy.deepcopy(value)
+            self._response_cache.move_to_end(key)
+            while len(self._response_cache) > _MAX_CACHED_RESPONSES:
+                self._response_cache.popitem(last=False)
+    
+    def _stream_response(self, prompt: str, on_chunk: Optional[Callable[[str], None]] = None) -> str:
+        """
+        Stream the LLM response for a prompt, passing the text received so far
+        to on_chunk after each chunk. Returns the full response text.
+        """
+        buffer = ""
+        for chunk in self.model.stream(prompt):
+            buffer += chunk.content
+            if on_chunk:
+                on_chunk(buffer)
+        return buffer
     
-    def generate_knowledge_tree(self, topic: str, content: str) -> Dict[str, Any]:
+    def generate_knowledge_tree(self, topic: str, content: str,
+                                on_chunk: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
         """
         Generate a knowledge tree for a given topic and content.
+        If on_chunk is given, it is called with the partial response as it streams in.
         Returns a dictionary representing the knowledge tree.
         """
         logger.info(f"Generating knowledge tree for: {topic}")
         
+        cache_key = self._cache_key("tree", topic, content)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            logger.info(f"Using cached knowledge tree for: {topic}")
+            return cached
+        
         # Use the LLM to generate a knowledge tree
         prompt_template = PromptTemplate.from_template(
             """You are a knowledge organizer tasked with creating a structured knowledge tree about {topic}.
@@ -61,12 +118,13 @@ class KnowledgeTreeManager:
         
         try:
             prompt = prompt_template.format(topic=topic, content=content)
-            response = self.model.invoke(prompt)
+            response_text = self._stream_response(prompt, on_chunk)
             
             # Extract JSON from the response
-            json_str = self._extract_json(response.content)
-            knowledge_tree = json.loads(json_str)
+            json_str = self._extract_json(response_text)
+            knowledge_tree = orjson.loads(json_str)
             
+            self._cache_put(cache_key, knowledge_tree)
             return knowledge_tree
         except Exception as e:
             logger.error(f"Error generating knowledge tree: {str(e)}")
@@ -89,20 +147,51 @@ class KnowledgeTreeManager:
     def _extract_json(self, text: str) -> str:
         """Extract JSON from text that might contain markdown code blocks or other text."""
         # Look for JSON between triple backticks
-        import re
-        json_match = re.search(r'```(?:json)?\s*([\s\S]*?)\s*```', text)
+        json_match = _JSON_FENCE_RE.search(text)
         
         if json_match:
             return json_match.group(1)
         
         # If no code blocks, try to find JSON between curly braces
-        json_match = re.search(r'({[\s\S]*})', text)
+        json_match = _JSON_BRACE_RE.search(text)
         if json_match:
             return json_match.group(1)
         
         # If nothing found, return the original text
         return text
     
+    def _parse_expansions(self, json_str: str) -> List[Dict[str, Any]]:
+        """
+        Parse the "expansions" list of a batched expansion response. If the response
+        was cut off (e.g. at the output token limit), keep the entries that are complete.
+        """
+        try:
+            return orjson.loads(json_str).get("expansions", [])
+        except orjson.JSONDecodeError:
+            marker = json_str.find('"expansions"')
+            start = json_str.find("[", marker) if marker != -1 else -1
+            if start == -1:
+                raise
+            
+            decoder = json.JSONDecoder()
+            expansions = []
+            pos = start + 1
+            while True:
+                # Skip the separators between entries
+                while pos < len(json_str) and json_str[pos] in " \t\r\n,":
+                    pos += 1
+                try:
+                    expansion, pos = decoder.raw_decode(json_str, pos)
+                except ValueError:
+                    break
+                if isinstance(expansion, dict):
+                    expansions.append(expansion)
+            
+            if not expansions:
+                raise
+            logger.warning(f"Batched expansion response was incomplete, kept {len(expansions)} entries")
+            return expansions
+    
     def research_topic(self, topic: str, summary: str, sources: List[str]) -> Dict[str, Any]:
         """
         Research a topic and generate a knowledge tree.
@@ -118,13 +207,21 @@ class KnowledgeTreeManager:
         
         return knowledge_tree
     
-    def expand_subtopic(self, topic: str, subtopic: str, content: str) -> Dict[str, Any]:
+    def expand_subtopic(self, topic: str, subtopic: str, content: str,
+                        on_chunk: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
         """
         Expand a subtopic with more detailed information.
+        If on_chunk is given, it is called with the partial response as it streams in.
         Returns a dictionary with the expanded subtopic information.
         """
         logger.info(f"Expanding subtopic: {subtopic} for topic: {topic}")
         
+        cache_key = self._cache_key("expand", topic, subtopic, content)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            logger.info(f"Using cached expansion for subtopic: {subtopic}")
+            return cached
+        
         prompt_template = PromptTemplate.from_template(
             """You are a knowledge organizer tasked with expanding detailed information about the subtopic {subtopic} 
             within the main topic {topic}.
@@ -159,12 +256,13 @@ class KnowledgeTreeManager:
         
         try:
             prompt = prompt_template.format(topic=topic, subtopic=subtopic, content=content)
-            response = self.model.invoke(prompt)
+            response_text = self._stream_response(prompt, on_chunk)
             
             # Extract JSON from the response
-            json_str = self._extract_json(response.content)
-            expanded_subtopic = json.loads(json_str)
+            json_str = self._extract_json(response_text)
+            expanded_subtopic = orjson.loads(json_str)
             
+            self._cache_put(cache_key, expanded_subtopic)
             return expanded_subtopic
         except Exception as e:
             logger.error(f"Error expanding subtopic: {str(e)}")
@@ -172,4 +270,92 @@ class KnowledgeTreeManager:
                 "subtopic": subtopic,
                 "overview": f"Failed to expand subtopic: {str(e)}",
                 "aspects": []
-            }
\ No newline at end of file
+            }
+    
+    def expand_subtopics_batch(self, topic: str, subtopic_names: List[str], content: str,
+                               on_chunk: Optional[Callable[[str], None]] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Expand several subtopics with a single LLM call.
+        If on_chunk is given, it is called with the partial response as it streams in.
+        Returns a dictionary mapping each subtopic name to its expansion, in the same
+        format as expand_subtopic. Subtopics the response does not cover are left out.
+        """
+        logger.info(f"Expanding {len(subtopic_names)} subtopics for topic: {topic}")
+        
+        cache_key = self._cache_key("expand_batch", topic, content, *subtopic_names)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            logger.info(f"Using cached expansions for topic: {topic}")
+            return cached
+        
+        prompt_template = PromptTemplate.from_template(
+            """You are a knowledge organizer tasked with expanding detailed information about several
+            subtopics within the main topic {topic}.
+            
+            The subtopics to expand are:
+            
+            {subtopics}
+            
+            Based on the following content:
+            
+            {content}
+            
+            For each subtopic, generate a detailed expansion with the following structure:
+            1. Brief overview of the subtopic (2-3 sentences)
+            2. 3-5 key aspects or components of this subtopic
+            3. For each aspect, provide detailed information (2-3 paragraphs)
+            4. Include any relevant examples, case studies, or applications
+            
+            Format your response as a JSON object with the following structure, with one entry
+            per subtopic in the order given and the subtopic names copied exactly:
+            {{
+                "expansions": [
+                    {{
+                        "subtopic": "Subtopic 1",
+                        "overview": "Brief overview text",
+                        "aspects": [
+                            {{
+                                "name": "Aspect 1",
+                                "details": "Detailed information about Aspect 1",
+                                "examples": ["Example 1", "Example 2"]
+                            }},
+                            // more aspects...
+                        ]
+                    }},
+                    // more subtopics...
+                ]
+            }}
+            
+            Ensure the information is accurate, comprehensive, and well-structured.
+            """
+        )
+        
+        try:
+            subtopics = "\n".join(f"- {name}" for name in subtopic_names)
+            prompt = prompt_template.format(topic=topic, subtopics=subtopics, content=content)
+            response_text = self._stream_response(prompt, on_chunk)
+            
+            # Extract JSON from the response
+            json_str = self._extract_json(response_text)
+            expansions = self._parse_expansions(json_str)
+            
+            # Match expansions by name. Position is only trusted when every subtopic
+            # got an entry, and never for an entry named after another subtopic.
+            by_name = {expansion.get("subtopic"): expansion for expansion in expansions}
+            by_position = len(expansions) == len(subtopic_names)
+            used = set()
+            expanded_subtopics = {}
+            for i, name in enumerate(subtopic_names):
+                expansion = by_name.get(name)
+                if expansion is None and by_position and expansions[i].get("subtopic") not in subtopic_names:
+                    expansion = expansions[i]
+                if expansion is None or id(expansion) in used:
+                    continue
+                used.add(id(expansion))
+                expanded_subtopics[name] = dict(expansion, subtopic=name)
+            
+            self._cache_put(cache_key, expanded_subtopics)
+            return expanded_subtopics
+        except Exception as e:
+            logger.error(f"Error expanding subtopics: {str(e)}")
+            return {}
\ No newline at end of file
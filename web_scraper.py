@@ -1,66 +1,109 @@
 import os
-from langchain_community.utilities import SerpAPIWrapper
 from langchain_core.prompts import PromptTemplate
 from langchain_google_genai import ChatGoogleGenerativeAI
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
+from functools import lru_cache
 import time
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from selectolax.lexbor import LexborHTMLParser
 import re
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit
+from serpapi import GoogleSearch
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Line breaks (\n, \r, \f, \v as in str.splitlines) with surrounding whitespace,
+# or runs of 2+ spaces/tabs
+_WS_RE = re.compile(r"[ \t]*[\n\r\f\v]\s*|[ \t]{2,}")
+
+# Only the start of a page is parsed; 8000 text chars fit well within it
+_MAX_HTML_BYTES = 256 * 1024
+
+# Query parameters that only track the click and don't change the page
+_TRACKING_PARAM_RE = re.compile(r"^(utm_|fbclid|gclid)")
+
+def _canonicalize_url(url: str) -> str:
+    """Lowercase the host and drop the fragment and tracking query parameters."""
+    parts = urlsplit(url)
+    # Filter the raw "key=value" pairs so the remaining ones keep their encoding
+    query = "&".join(
+        param for param in parts.query.split("&")
+        if param and not _TRACKING_PARAM_RE.match(param)
+    )
+    return urlunsplit((parts.scheme, parts.netloc.lower(), parts.path, query, ""))
+
+@lru_cache(maxsize=128)
+def _cached_search(query: str, num_results: int, api_key: str) -> Tuple[Tuple[str, str, str], ...]:
+    """
+    Run a SerpAPI Google search and return (title, snippet, link) tuples.
+    Results are memoized per (query, num_results, api_key). Raises LookupError
+    when there are no results, so empty responses are not cached.
+    """
+    # Query SerpAPI directly, since SerpAPIWrapper doesn't accept num_results
+    search_params = {
+        "engine": "google",
+        "q": query,
+        "api_key": api_key,
+        "num": num_results  # Number of results
+    }
+    
+    search = GoogleSearch(search_params)
+    results = search.get_dict()
+    
+    if not results or "organic_results" not in results:
+        raise LookupError(query)
+    
+    # Canonicalize links and keep only the first result per page
+    unique_results = OrderedDict()
+    for result in results["organic_results"][:num_results]:
+        link = _canonicalize_url(result.get("link", ""))
+        unique_results.setdefault(link, (result.get("title", ""), result.get("snippet", ""), link))
+    
+    return tuple(unique_results.values())
+
 class WebScraper:
     def __init__(self, serpapi_key: str, gemini_api_key: str):
         self.serpapi_key = serpapi_key
         self.gemini_api_key = gemini_api_key
-        self.search = SerpAPIWrapper(serpapi_api_key=self.serpapi_key)
         self.model = ChatGoogleGenerativeAI(
             model="gemini-2.0-flash",
             google_api_key=self.gemini_api_key,
             temperature=0.3
         )
         
+        # Reuse connections across article fetches
+        self.session = requests.Session()
+        self.session.headers.update({
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+        })
+        adapter = HTTPAdapter(
+            pool_connections=8,
+            pool_maxsize=16,
+            max_retries=Retry(total=2, backoff_factor=0.3)
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        
     def search_web(self, query: str, num_results: int = 5) -> List[Dict[str, Any]]:
         """Search the web for a given query and return the top results."""
         try:
             logger.info(f"Searching for: {query}")
             
-            # SerpAPIWrapper.results() doesn't accept num_results, so we'll use the run method
-            # which returns a string and then handle the parsing ourselves
-            raw_results = self.search.run(query)
-            
-            # Parse the search results manually
-            search_params = {
-                "engine": "google",
-                "q": query,
-                "api_key": self.serpapi_key,
-                "num": num_results  # Number of results
-            }
-            
-            import json
-            from serpapi import GoogleSearch
-            
-            search = GoogleSearch(search_params)
-            results = search.get_dict()
-            
-            if not results or "organic_results" not in results:
-                logger.warning(f"No search results found for: {query}")
-                return []
-                
-            # Extract relevant information from search results
-            formatted_results = []
-            for result in results["organic_results"][:num_results]:
-                formatted_results.append({
-                    "title": result.get("title", ""),
-                    "snippet": result.get("snippet", ""),
-                    "link": result.get("link", "")
-                })
+            formatted_results = [
+                {"title": title, "snippet": snippet, "link": link}
+                for title, snippet, link in _cached_search(query, num_results, self.serpapi_key)
+            ]
             
             logger.info(f"Found {len(formatted_results)} results")
             return formatted_results
+        except LookupError:
+            logger.warning(f"No search results found for: {query}")
+            return []
         except Exception as e:
             logger.error(f"Error searching web: {str(e)}")
             return []
@@ -69,30 +112,24 @@ class WebScraper:
         """Fetch and parse the content of an article from a given URL."""
         try:
             logger.info(f"Fetching content from: {url}")
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-            }
-            response = requests.get(url, headers=headers, timeout=10)
-            response.raise_for_status()
+            with self.session.get(url, timeout=10, stream=True) as response:
+                response.raise_for_status()
+                raw = response.raw.read(_MAX_HTML_BYTES, decode_content=True)
+                html = raw.decode(response.encoding or "utf-8", errors="replace")
             
-            soup = BeautifulSoup(response.text, 'html.parser')
+            tree = LexborHTMLParser(html)
             
             # Remove script and style elements
-            for script in soup(["script", "style", "nav", "footer", "header"]):
-                script.extract()
+            for node in tree.css("script, style, nav, footer, header"):
+                node.decompose()
             
             # Get text
-            text = soup.get_text()
-            
-            # Break into lines and remove leading and trailing space on each
-            lines = (line.strip() for line in text.splitlines())
-            # Break multi-headlines into a line each
-            chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-            # Remove blank lines
-            text = '\n'.join(chunk for chunk in chunks if chunk)
+            root = tree.body or tree.root
+            text = root.text(separator="\n", strip=True) if root else ""
             
-            # Truncate to reasonable length (first 8000 chars)
-            text = text[:8000]
+            # Collapse whitespace into single line breaks and truncate to
+            # reasonable length (first 8000 chars)
+            text = _WS_RE.sub("\n", text).strip()[:8000]
             
             return text
         except Exception as e: